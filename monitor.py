@@ -1,4 +1,10 @@
 import time
+import sys
+import json
+import traceback
+import collections
+import ipaddress
+import urllib.parse
 import concurrent.futures
 import random
 import warnings
@@ -75,6 +81,13 @@ REQUEST_TIMEOUT = 10  # seconds for lightweight HTTP checks
 SELENIUM_PAGE_LOAD_TIMEOUT = 10  # seconds for Selenium page loads
 SELENIUM_MAX_ATTEMPTS = 1
 
+# Redirect-chain cache: fast checks go straight to the canonical (final) URL of sites that
+# redirect, and the entry URL is re-resolved every REDIRECT_CACHE_TTL seconds to confirm
+# the chain has not changed. Chain changes are logged and kept in a rolling event list.
+REDIRECT_CACHE_ENABLED = True
+REDIRECT_CACHE_TTL = 300  # seconds
+REDIRECT_EVENTS_MAX = 100
+
 # Only use Selenium for sites that require JS rendering. Leave empty to avoid heavy browser starts.
 # Add exact hostnames or full URLs that need Selenium, e.g. {"https://example.com"}
 # `https://ma.gov.br` is slow/has cert issues — handle it with Selenium.
@@ -90,6 +103,17 @@ SELENIUM_OVERRIDES = {
 SERVER_HOST = "0.0.0.0"
 SERVER_PORT = 8000
 
+# Admin/diagnostics endpoints under /admin/ on the dashboard server. They are unauthenticated,
+# so by default they only answer loopback clients (run curl on the monitor host itself).
+ADMIN_ENABLED = True
+ADMIN_LOCAL_ONLY = True
+PROFILE_SAMPLE_INTERVAL = 0.01  # seconds between stack samples (~100 Hz)
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 120
+TRACE_MAX_CYCLES = 50  # cycles kept in the rolling trace
+# Thread name prefixes included by /admin/stacks (use ?all=1 for every thread)
+STACK_DUMP_PREFIXES = ("MainThread", "probe", "selenium")
+
 def get_local_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
@@ -101,6 +125,119 @@ def get_local_ip():
         s.close()
     return ip
 
+# Rolling trace of the last cycles: each cycle holds per-phase spans (submit, probes, render, write)
+_trace_lock = threading.Lock()
+_cycle_traces = collections.deque(maxlen=TRACE_MAX_CYCLES)
+_current_trace = None
+
+# Only one sampling profiler may run at a time
+_profile_lock = threading.Lock()
+
+def begin_cycle_trace():
+    global _current_trace
+    trace = {
+        "started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "t0": time.perf_counter(),
+        "spans": [],
+    }
+    with _trace_lock:
+        _current_trace = trace
+    return trace
+
+def add_span(trace, name, start, end, **attrs):
+    """Records a span (perf_counter start/end) relative to the cycle start."""
+    span = {
+        "name": name,
+        "start_ms": round((start - trace["t0"]) * 1000, 1),
+        "duration_ms": round((end - start) * 1000, 1),
+        "thread": threading.current_thread().name,
+    }
+    span.update(attrs)
+    with _trace_lock:
+        trace["spans"].append(span)
+
+def end_cycle_trace(trace, error=None):
+    """Moves the cycle to the rolling trace; calling it again for the same cycle is a no-op."""
+    global _current_trace
+    with _trace_lock:
+        if "duration_ms" in trace:
+            return
+        if error is not None:
+            trace["error"] = error
+        trace["duration_ms"] = round((time.perf_counter() - trace["t0"]) * 1000, 1)
+        _cycle_traces.append(trace)
+        if _current_trace is trace:
+            _current_trace = None
+
+def traced_probe(trace, probe, site, *args):
+    """Runs a probe (fast_check/selenium_check) inside the executor, recording its span."""
+    start = time.perf_counter()
+    try:
+        return probe(site, *args)
+    finally:
+        add_span(trace, f"probe:{site[0]}", start, time.perf_counter(), url=site[1], kind=probe.__name__)
+
+def get_cycle_traces(limit=None):
+    """Returns the last `limit` finished cycles (oldest first) plus the in-progress one, if any."""
+    def public(trace, in_progress):
+        item = {k: v for k, v in trace.items() if k != "t0"}
+        item["spans"] = sorted(trace["spans"], key=lambda sp: sp["start_ms"])
+        if in_progress:
+            item["in_progress"] = True
+            item["elapsed_ms"] = round((time.perf_counter() - trace["t0"]) * 1000, 1)
+        return item
+
+    with _trace_lock:
+        finished = list(_cycle_traces)
+        if limit is not None:
+            finished = finished[-limit:] if limit > 0 else []
+        items = [public(t, False) for t in finished]
+        if _current_trace is not None:
+            items.append(public(_current_trace, True))
+    return items
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def sample_profile(seconds, interval=PROFILE_SAMPLE_INTERVAL):
+    """
+    Samples the stacks of every thread for `seconds` and returns them in collapsed-stack
+    format ("thread;outer;...;inner count" per line), as consumed by flamegraph.pl/speedscope.
+    """
+    me = threading.get_ident()
+    counts = {}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            key = ";".join(reversed(stack))
+            counts[key] = counts.get(key, 0) + 1
+        time.sleep(interval)
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(counts.items()))
+
+def dump_thread_stacks(include_all=False):
+    """Formats the current stack of the main, probe and Selenium executor threads."""
+    frames = sys._current_frames()
+    out = []
+    for t in threading.enumerate():
+        if not include_all and not t.name.startswith(STACK_DUMP_PREFIXES):
+            continue
+        frame = frames.get(t.ident)
+        if frame is None:
+            continue
+        out.append(f'Thread "{t.name}" (ident={t.ident}, daemon={t.daemon}):\n')
+        out.extend(traceback.format_stack(frame))
+        out.append("\n")
+    return "".join(out) or "Nenhuma thread correspondente.\n"
+
 class NoCacheHandler(http.server.SimpleHTTPRequestHandler):
     def end_headers(self):
         # Ensure browsers do not cache the dashboard
@@ -110,11 +247,60 @@ class NoCacheHandler(http.server.SimpleHTTPRequestHandler):
         super().end_headers()
 
     def do_GET(self):
+        if ADMIN_ENABLED and self.path.startswith('/admin/'):
+            if ADMIN_LOCAL_ONLY and not ipaddress.ip_address(self.client_address[0]).is_loopback:
+                return self.send_error(403, "Admin endpoints are only available from localhost")
+            return self.handle_admin()
         # Serve index.html for root
         if self.path in ('', '/', '/index.html'):
             self.path = '/index.html'
         return super().do_GET()
 
+    def send_body(self, body, content_type, extra_headers=None):
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_admin(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        try:
+            if parsed.path == '/admin/profile':
+                seconds = float(query.get('seconds', [PROFILE_DEFAULT_SECONDS])[0])
+                if not 0 < seconds <= PROFILE_MAX_SECONDS:
+                    return self.send_error(400, f"seconds must be in (0, {PROFILE_MAX_SECONDS}]")
+                if not _profile_lock.acquire(blocking=False):
+                    return self.send_error(409, "Profiler already running")
+                try:
+                    body = sample_profile(seconds)
+                finally:
+                    _profile_lock.release()
+                filename = f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+                return self.send_body(body, 'text/plain; charset=utf-8',
+                                      {'Content-Disposition': f'attachment; filename="{filename}"'})
+
+            if parsed.path == '/admin/stacks':
+                include_all = query.get('all', ['0'])[0] not in ('', '0', 'false')
+                return self.send_body(dump_thread_stacks(include_all), 'text/plain; charset=utf-8')
+
+            if parsed.path == '/admin/trace':
+                limit = int(query['cycles'][0]) if 'cycles' in query else None
+                body = json.dumps(get_cycle_traces(limit), ensure_ascii=False, indent=2)
+                return self.send_body(body, 'application/json; charset=utf-8')
+
+            if parsed.path == '/admin/redirects':
+                body = json.dumps(get_redirect_state(), ensure_ascii=False, indent=2)
+                return self.send_body(body, 'application/json; charset=utf-8')
+        except ValueError as e:
+            return self.send_error(400, f"Invalid parameter: {e}")
+
+        return self.send_error(404, "Unknown admin endpoint")
+
 def start_http_server(host=SERVER_HOST, port=SERVER_PORT):
     # Serve files from this script directory
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
@@ -123,6 +309,8 @@ def start_http_server(host=SERVER_HOST, port=SERVER_PORT):
         httpd.allow_reuse_address = True
         local_ip = get_local_ip()
         print(f"HTTP server: http://{local_ip}:{port}/ (listening on {host}:{port})")
+        if ADMIN_ENABLED:
+            print("Admin: /admin/profile?seconds=N, /admin/stacks, /admin/trace?cycles=K, /admin/redirects")
         try:
             httpd.serve_forever()
         except Exception as e:
@@ -278,13 +466,120 @@ def check_wrapper(site_tuple):
     return name, url, ok, code, ms, err
 
 
+# Resolved redirect chains:
+#   entry url -> {"chain": [entry, ..., final], "status": int, "direct": bool, "resolved_at": monotonic}
+# "status" is the final URL's code at the last resolution; a direct probe answering anything else
+# is re-followed from the entry URL. "direct" is False when the final URL itself redirects (e.g.
+# session-cookie logins) or answered 4xx, in which case probes keep going through the entry URL
+# until the next revalidation. "resolved_at" only
+# moves on revalidation (first probe, TTL expiry, canonical failure) or on a chain change.
+_redirect_lock = threading.Lock()
+_redirect_cache = {}
+_redirect_events = collections.deque(maxlen=REDIRECT_EVENTS_MAX)
+
+def get_redirect_plan(url):
+    """
+    Decides how to probe `url`. Returns (canonical_url, expected_status, revalidate):
+    canonical_url is the cached final URL to hit directly, or None to follow from the entry URL;
+    expected_status is the code it answered when the chain was resolved;
+    revalidate is True when that follow is due to refresh the cached chain.
+    """
+    if not REDIRECT_CACHE_ENABLED:
+        return None, None, False
+    with _redirect_lock:
+        entry = _redirect_cache.get(url)
+        if entry is None or entry["resolved_at"] is None:
+            return None, None, True
+        if time.monotonic() - entry["resolved_at"] >= REDIRECT_CACHE_TTL:
+            return None, None, True
+        if entry["direct"] and len(entry["chain"]) >= 2:
+            return entry["chain"][-1], entry["status"], False
+        return None, None, False
+
+def expire_redirect(url):
+    """Forces the next probe of `url` to resolve the chain again (the old chain is kept for comparison)."""
+    with _redirect_lock:
+        entry = _redirect_cache.get(url)
+        if entry is not None:
+            entry["resolved_at"] = None
+
+def record_redirect_chain(name, url, response, revalidate, canonical_redirected=False):
+    """
+    Compares the chain followed by `response` with the cached one, reporting changes.
+    The entry is only rewritten on revalidation or when the chain changed, so routine
+    entry-URL probes of non-direct sites don't reset their TTL.
+    """
+    if not REDIRECT_CACHE_ENABLED or response.status_code >= 500:
+        return
+    chain = [hop.url for hop in response.history] + [response.url]
+    with _redirect_lock:
+        entry = _redirect_cache.get(url)
+        old_chain = entry["chain"] if entry else None
+        changed = old_chain is not None and old_chain != chain
+        if entry is None or revalidate or changed:
+            _redirect_cache[url] = {
+                "chain": chain,
+                "status": response.status_code,
+                # Same chain but the canonical URL redirected on its own: stop probing it directly.
+                # 4xx final pages are not probed directly either (they may depend on skipped hops).
+                "direct": (changed or not canonical_redirected) and response.status_code < 400,
+                "resolved_at": time.monotonic(),
+            }
+        if changed:
+            _redirect_events.append({
+                "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "name": name,
+                "url": url,
+                "old_chain": old_chain,
+                "new_chain": chain,
+            })
+    if changed:
+        print(f"Redirect: {name:<20} -> cadeia alterada: {' -> '.join(old_chain)} => {' -> '.join(chain)}")
+
+def get_redirect_state():
+    """Snapshot of the redirect cache and recent chain-change events (for /admin/redirects)."""
+    now = time.monotonic()
+    with _redirect_lock:
+        cache = {
+            url: {
+                "chain": list(entry["chain"]),
+                "status": entry["status"],
+                "direct": entry["direct"],
+                "age_s": round(now - entry["resolved_at"], 1) if entry["resolved_at"] is not None else None,
+            }
+            for url, entry in _redirect_cache.items()
+        }
+        events = list(_redirect_events)
+    return {"ttl_s": REDIRECT_CACHE_TTL, "cache": cache, "events": events}
+
+
 def fast_check(site_tuple):
     name, url = site_tuple
     t0 = time.perf_counter()
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+    }
+    canonical, expected_status, revalidate = get_redirect_plan(url)
+    canonical_redirected = False
     try:
-        r = requests.get(url, timeout=REQUEST_TIMEOUT, verify=False, allow_redirects=True, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        })
+        r = None
+        if canonical is not None:
+            # Skip the known redirect hops and hit the final URL directly
+            try:
+                r = requests.get(canonical, timeout=REQUEST_TIMEOUT, verify=False, allow_redirects=False, headers=headers)
+            except requests.RequestException:
+                r = None
+            if r is None or r.is_redirect or r.status_code >= 400 or r.status_code != expected_status:
+                # The canonical URL is unreachable, redirects on its own, errors or answers a
+                # different code: the chain may have changed, so follow it again from the entry
+                # URL in this same probe and only report the site DOWN if that fails too
+                canonical_redirected = r is not None and r.is_redirect
+                revalidate = True
+                expire_redirect(url)
+                r = None
+        if r is None:
+            r = requests.get(url, timeout=REQUEST_TIMEOUT, verify=False, allow_redirects=True, headers=headers)
+            record_redirect_chain(name, url, r, revalidate, canonical_redirected)
         code = r.status_code
         if code >= 500:
             ms = int((time.perf_counter() - t0) * 1000)
@@ -603,8 +898,10 @@ def main():
     failure_counts = {}
 
     while True:
+        trace = None
         try:
             start_check = time.time()
+            trace = begin_cycle_trace()
             rows = []
             
             # Split sites between fast checks and Selenium-required checks so slow Selenium
@@ -613,11 +910,12 @@ def main():
             fast_sites = [s for s in SITES if s[1] not in SELENIUM_REQUIRED]
 
               # Executors
-            with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as fast_executor, \
-                  concurrent.futures.ThreadPoolExecutor(max_workers=SELENIUM_WORKERS) as selenium_executor:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="probe") as fast_executor, \
+                  concurrent.futures.ThreadPoolExecutor(max_workers=SELENIUM_WORKERS, thread_name_prefix="selenium") as selenium_executor:
 
+                submit_start = time.perf_counter()
                 # submit fast checks
-                fast_futures = {fast_executor.submit(fast_check, site): site for site in fast_sites}
+                fast_futures = {fast_executor.submit(traced_probe, trace, fast_check, site): site for site in fast_sites}
 
                 # submit selenium checks with overrides when present
                 selenium_futures = {}
@@ -625,9 +923,10 @@ def main():
                     url = site[1]
                     overrides = SELENIUM_OVERRIDES.get(url, {})
                     selenium_futures[selenium_executor.submit(
-                        selenium_check, site,
+                        traced_probe, trace, selenium_check, site,
                         overrides.get('page_load_timeout'),
                         overrides.get('attempts'))] = site
+                add_span(trace, "submit", submit_start, time.perf_counter())
 
                 # process completed futures from both pools as they finish
                 all_futures = list(fast_futures.keys()) + list(selenium_futures.keys())
@@ -655,10 +954,15 @@ def main():
                         print(f"Generated an exception: {exc}")
 
             generated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            render_start = time.perf_counter()
             html = render_html(rows, generated_at, failure_counts)
+            write_start = time.perf_counter()
+            add_span(trace, "render", render_start, write_start)
             
             with open("index.html", "w", encoding="utf-8") as f:
                 f.write(html)
+            add_span(trace, "write", write_start, time.perf_counter())
+            end_cycle_trace(trace)
 
             elapsed = time.time() - start_check
             print(f"[{generated_at}] Ciclo completo em {elapsed:.2f}s. index.html atualizado.")
@@ -671,8 +975,14 @@ def main():
             print("\nMonitoramento interrompido.")
             break
         except Exception as e:
+            if trace is not None:
+                end_cycle_trace(trace, error=str(e))
             print(f"\nErro no loop principal: {e}")
             time.sleep(5)
+        finally:
+            # Cycles interrupted by any other exit must not stay "in progress" in /admin/trace
+            if trace is not None:
+                end_cycle_trace(trace)
 
 if __name__ == "__main__":
     main()